@@ -15,16 +15,41 @@ from ansible.module_utils.six.moves.http_cookiejar import CookieJar
 import os.path
 from socket import gethostbyname
 import re
-from json import loads, dumps
+from json import dumps
 import base64
+import hashlib
 import os
+import stat
+import sys
+import tempfile
+import threading
 import time
 
+try:
+    # orjson is optional, it just parses large API responses much faster than the standard library
+    from orjson import loads
+except ImportError:
+    from json import loads
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+
+    HAS_THREAD_POOL = True
+except ImportError:
+    HAS_THREAD_POOL = False
+
 
 class ItemNotDefined(Exception):
     pass
 
 
+class ModuleFailure(Exception):
+    # Raised in place of fail_json while a failure is being captured, carrying what would have been reported
+    def __init__(self, **kwargs):
+        super(ModuleFailure, self).__init__(kwargs.get("msg"))
+        self.fail_kwargs = kwargs
+
+
 class EDAModule(AnsibleModule):
     url = None
     session = None
@@ -62,7 +87,7 @@ class EDAModule(AnsibleModule):
         "verify_ssl": "validate_certs",
         "request_timeout": "request_timeout",
     }
-    IDENTITY_FIELDS = {"users": "username"}
+    IDENTITY_FIELDS = {"users": "username", "extra-vars": "id"}
     ENCRYPTED_STRING = "$encrypted$"
     host = "127.0.0.1"
     username = None
@@ -73,6 +98,9 @@ class EDAModule(AnsibleModule):
     authenticated = False
     error_callback = None
     warn_callback = None
+    ROLE_CACHE_TTL = 60
+    _role_cache = None
+    _exiting = False
 
     def __init__(self, argument_spec=None, direct_params=None, error_callback=None, warn_callback=None, require_auth=True, **kwargs):
         full_argspec = {}
@@ -85,20 +113,30 @@ class EDAModule(AnsibleModule):
         self.warn_callback = warn_callback
 
         self.json_output = {"changed": False}
+        self._exit_lock = threading.Lock()
+        self._etag_cache = {}
+        self._resolve_cache = {}
 
         if direct_params is not None:
             self.params = direct_params
         else:
             super(EDAModule, self).__init__(argument_spec=full_argspec, **kwargs)
 
-        self.session = Request(cookies=CookieJar(), validate_certs=self.verify_ssl, timeout=self.request_timeout)
-
         # Parameters specified on command line will override settings in any config
         for short_param, long_param in self.short_params.items():
             direct_value = self.params.get(long_param)
             if direct_value is not None:
                 setattr(self, short_param, direct_value)
 
+        # A single session is shared by every request this module makes, so it is built once the connection settings are known
+        self.session = Request(
+            cookies=CookieJar(),
+            headers={"Accept": "application/json"},
+            validate_certs=self.verify_ssl,
+            timeout=self.request_timeout,
+            follow_redirects=True,
+        )
+
         # Perform some basic validation
         if not re.match("^https{0,1}://", self.host):
             self.host = "https://{0}".format(self.host)
@@ -143,12 +181,21 @@ class EDAModule(AnsibleModule):
         if self.error_callback:
             self.error_callback(**kwargs)
         else:
+            self._claim_exit(1)
             super(EDAModule, self).fail_json(**kwargs)
 
     def exit_json(self, **kwargs):
         # Try to log out if we are authenticated
+        self._claim_exit(0)
         super(EDAModule, self).exit_json(**kwargs)
 
+    def _claim_exit(self, status):
+        # Requests made by run_concurrently may all try to finish the module, only the first one gets to report a result
+        with self._exit_lock:
+            if self._exiting:
+                sys.exit(status)
+            self._exiting = True
+
     def warn(self, warning):
         if self.warn_callback is not None:
             self.warn_callback(warning)
@@ -173,9 +220,6 @@ class EDAModule(AnsibleModule):
         # Authenticate to EDA controller (if we don't have a token and if not already done so)
         if not self.authenticated:
             self.authenticate(**kwargs)
-        if self.basic_auth:
-            basic_str = base64.b64encode("{0}:{1}".format(self.username, self.password).encode("ascii"))
-            headers["Authorization"] = "Basic {0}".format(basic_str.decode("ascii"))
         if method in ["POST", "PUT", "PATCH"]:
             headers.setdefault("Content-Type", "application/json")
             kwargs["headers"] = headers
@@ -194,9 +238,6 @@ class EDAModule(AnsibleModule):
                 method,
                 url.geturl(),
                 headers=headers,
-                validate_certs=self.verify_ssl,
-                timeout=self.request_timeout,
-                follow_redirects=True,
                 data=data,
             )
         except (SSLValidationError) as ssl_err:
@@ -243,6 +284,9 @@ class EDAModule(AnsibleModule):
                 # JSONDecodeError only available on Python 3.5+
                 except ValueError:
                     return {"status_code": he.code, "text": page_data}
+            elif he.code == 304:
+                # Not Modified, the caller asked for this by sending an ETag so is able to use its own copy
+                return {"status_code": he.code, "json": {}}
             elif he.code == 204 and method == "DELETE":
                 # A 204 is a normal response for a delete function
                 pass
@@ -268,7 +312,11 @@ class EDAModule(AnsibleModule):
             status_code = response.getcode()
         else:
             status_code = response.status
-        return {"status_code": status_code, "json": response_json}
+        result = {"status_code": status_code, "json": response_json}
+        etag = response.info().get("ETag")
+        if etag:
+            result["etag"] = etag
+        return result
 
     def get_one(self, endpoint, name_or_id=None, allow_none=True, key="url", **kwargs):
         new_kwargs = kwargs.copy()
@@ -304,12 +352,17 @@ class EDAModule(AnsibleModule):
         elif response["json"]["count"] > 1:
             if name_or_id:
                 # Since we did a name or ID search and got > 1 return something if the id matches or the name matches exactly
+                # The matches may span several pages, so walk them until we find an id match or know the name is ambiguous
+                # An id match takes priority over any number of name matches, so while one is still possible keep walking
+                id_search = "or__id" in new_data
                 exact_matches = []
-                for asset in response["json"]["results"]:
+                for asset in self._iter_results(response):
                     if str(asset["id"]) == name_or_id:
                         return self.existing_item_add_url(asset, endpoint, key=key)
                     if str(asset[name_field]) == name_or_id:
                         exact_matches.append(self.existing_item_add_url(asset, endpoint, key=key))
+                        if len(exact_matches) > 1 and not id_search:
+                            break
                 # If there is one exact name match then return that
                 if len(exact_matches) == 1:
                     return exact_matches[0]
@@ -375,6 +428,10 @@ class EDAModule(AnsibleModule):
         # api_token_url = self.build_url("auth/session/login").geturl()[:-1]
 
         # If we have not managed to authenticate of these, then we can try un-authenticated access or use basic auth
+        # Basic auth needs no exchange with the server, so the header is built once and sent by the session on every request
+        if self.basic_auth:
+            basic_str = base64.b64encode("{0}:{1}".format(self.username, self.password).encode("ascii"))
+            self.session.headers["Authorization"] = "Basic {0}".format(basic_str.decode("ascii"))
         self.authenticated = True
 
     def existing_item_add_url(self, existing_item, endpoint, key="url"):
@@ -457,6 +514,27 @@ class EDAModule(AnsibleModule):
 
         return self.make_request("DELETE", endpoint, **kwargs)
 
+    def delete_endpoint_or_warn(self, endpoint):
+        # For tidying up after another failure, so a problem here is only a warning and the original failure is what gets reported
+        try:
+            response = self.capture_failure(self.delete_endpoint, endpoint, return_none_on_404=True)
+        except ModuleFailure as mf:
+            self.warn("Unable to delete {0}: {1}".format(endpoint, mf.fail_kwargs.get("msg")))
+            return
+        if response is not None and response["status_code"] not in [202, 204]:
+            self.warn("Unable to delete {0}: {1}".format(endpoint, response.get("json", response["status_code"])))
+
+    def capture_failure(self, function, *args, **kwargs):
+        # Call function, but raise ModuleFailure rather than failing the module if it calls fail_json
+        def raise_failure(**fail_kwargs):
+            raise ModuleFailure(**fail_kwargs)
+
+        error_callback, self.error_callback = self.error_callback, raise_failure
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.error_callback = error_callback
+
     def create_or_update_if_needed(
         self,
         existing_item,
@@ -504,11 +582,15 @@ class EDAModule(AnsibleModule):
         item_type="unknown",
         associations=None,
         treat_conflict_as_unchanged=False,
+        on_failure=None,
     ):
 
         # This will exit from the module on its own
         # If the method successfully creates an item and on_create param is defined,
         #    the on_create parameter will be called as a method pasing in this object and the json from the response
+        # If the create fails and on_failure param is defined,
+        #    the on_failure parameter will be called as a method passing in this object and the response before the module fails
+        #    (the response is None if the request itself failed)
         # This will return one of two things:
         #    1. None if the existing_item is already defined (so no create needs to happen)
         #    2. The response from EDA Controller from calling the patch on the endpont. It's up to you to process the response and exit from the module
@@ -530,7 +612,14 @@ class EDAModule(AnsibleModule):
             # We will pull the item_name out from the new_item, if it exists
             item_name = self.get_item_name(new_item, allow_unknown=True)
 
-            response = self.post_endpoint(endpoint, **{"data": new_item})
+            if on_failure is None:
+                response = self.post_endpoint(endpoint, **{"data": new_item})
+            else:
+                try:
+                    response = self.capture_failure(self.post_endpoint, endpoint, **{"data": new_item})
+                except ModuleFailure as mf:
+                    on_failure(self, None)
+                    self.fail_json(**mf.fail_kwargs)
 
             if response["status_code"] in [200, 201]:
                 self.json_output["name"] = "unknown"
@@ -547,6 +636,8 @@ class EDAModule(AnsibleModule):
             elif response["status_code"] in [409] and treat_conflict_as_unchanged:
                 self.json_output["changed"] = False
             else:
+                if on_failure is not None:
+                    on_failure(self, response)
                 if "json" in response and "__all__" in response["json"]:
                     self.fail_json(msg="Unable to create {0} {1}: {2}".format(item_type, item_name, response["json"]["__all__"][0]))
                 elif "json" in response:
@@ -749,11 +840,25 @@ class EDAModule(AnsibleModule):
         return self.make_request("PUT", endpoint, **kwargs)
 
     def get_all_endpoint(self, endpoint, *args, **kwargs):
+        # If the caller has put a copy of this list in _etag_cache, ask the server to only send it again if it has changed
+        cache_key = self.build_url(endpoint, query_params=kwargs.get("data")).geturl()
+        cached = self._etag_cache.pop(cache_key, None)
+        if cached is not None:
+            headers = kwargs.get("headers", {}).copy()
+            headers["If-None-Match"] = cached[0]
+            kwargs["headers"] = headers
+
         response = self.get_endpoint(endpoint, *args, **kwargs)
+        if response["status_code"] == 304:
+            return cached[1]
         if "next" not in response["json"]:
             raise RuntimeError("Expected list from API at {0}, got: {1}".format(endpoint, response))
         next_page = response["json"]["next"]
 
+        # The ETag only covers the first page, so it can't stand for a list that needs more than one
+        if next_page is not None:
+            response.pop("etag", None)
+
         if response["json"]["count"] > 10000:
             self.fail_json(msg="The number of items being queried for is higher than 10,000.")
 
@@ -764,6 +869,17 @@ class EDAModule(AnsibleModule):
             response["json"]["next"] = next_page
         return response
 
+    def _iter_results(self, response):
+        # Yield each item of a list response, only following the next link once the current page has been used up
+        # Unlike get_all_endpoint, a caller that stops early never fetches the later pages
+        page = response["json"]
+        while True:
+            for item in page["results"]:
+                yield item
+            if page.get("next") is None:
+                return
+            page = self.get_endpoint(page["next"])["json"]
+
     def fail_wanted_one(self, response, endpoint, query_params):
         sample = response.copy()
         if len(sample["json"]["results"]) > 1:
@@ -781,7 +897,99 @@ class EDAModule(AnsibleModule):
         return self.get_one(endpoint, name_or_id=name_or_id, allow_none=False, **kwargs)
 
     def resolve_name_to_id(self, endpoint, name_or_id, data=None):
-        return self.get_exactly_one(endpoint, name_or_id, **{"data": data if data else {}})["id"]
+        # Resolving the same object again within this module run is answered from memory rather than with another GET
+        # Nothing is invalidated, as no module renames or removes an object and then resolves it again in the same run
+        data = data if data else {}
+        cache_key = (endpoint, str(name_or_id), tuple(sorted(data.items())))
+        if cache_key not in self._resolve_cache:
+            self._resolve_cache[cache_key] = self.get_exactly_one(endpoint, name_or_id, **{"data": data})["id"]
+        return self._resolve_cache[cache_key]
+
+    def run_concurrently(self, *calls):
+        # Each call is a (function, args, kwargs) tuple; the results are returned in the same order as the calls
+        # Independent lookups are issued in parallel so their round trips overlap rather than queue up
+        if not HAS_THREAD_POOL or len(calls) < 2:
+            return [function(*args, **kwargs) for function, args, kwargs in calls]
+
+        with ThreadPoolExecutor(max_workers=len(calls)) as executor:
+            futures = [executor.submit(function, *args, **kwargs) for function, args, kwargs in calls]
+            return [future.result() for future in futures]
+
+    def get_role_ids_by_name(self):
+        # Roles are a fixed catalog on the server, so rather than fetch them for every user in a loop
+        # keep a short lived copy on disk, keyed by the host it came from
+        if self._role_cache is not None:
+            return self._role_cache
+
+        cache_path = self._role_cache_path()
+        cached = None
+        cache_age = None
+        if cache_path is not None:
+            try:
+                cache_stat = os.stat(cache_path)
+                cache_age = time.time() - cache_stat.st_mtime
+                # The cache decides which roles users are given, so only trust a file nobody else could have written
+                if self._is_private(cache_stat):
+                    with open(cache_path) as cache_file:
+                        cached = loads(cache_file.read())
+                    if not isinstance(cached, dict) or not self._is_roles_response(cached.get("response")):
+                        cached = None
+            except (OSError, IOError, ValueError):
+                # Missing, unreadable or corrupt cache, just fetch the roles again
+                cached = None
+
+        if cached is not None and 0 <= cache_age < self.ROLE_CACHE_TTL:
+            response = cached["response"]
+        else:
+            if cached is not None and cached.get("etag"):
+                # Even a stale copy saves the download if the server says the roles have not changed
+                self._etag_cache[self.build_url("roles").geturl()] = (cached["etag"], cached["response"])
+            response = self.get_all_endpoint("roles")
+            if cache_path is not None:
+                self._write_role_cache(cache_path, {"etag": response.get("etag"), "response": response})
+
+        self._role_cache = dict((role["name"], role["id"]) for role in response["json"]["results"])
+        return self._role_cache
+
+    def _role_cache_path(self):
+        # Keep the cache in a directory private to this user, a shared temp directory would let anyone plant one
+        cache_dir = os.path.expanduser(os.path.join("~", ".ansible", "tmp"))
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir, 0o700)
+            if not self._is_private(os.stat(cache_dir)):
+                return None
+        except (OSError, IOError):
+            return None
+        return os.path.join(cache_dir, "eda_roles_{0}.json".format(hashlib.sha1(self.host.encode("utf-8")).hexdigest()))
+
+    @staticmethod
+    def _write_role_cache(cache_path, cached):
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path))
+            with os.fdopen(fd, "w") as cache_file:
+                cache_file.write(dumps(cached))
+            os.rename(tmp_path, cache_path)
+        except (OSError, IOError):
+            # Caching is only an optimisation, so never fail the module over it
+            if tmp_path is not None and os.path.exists(tmp_path):
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _is_private(stat_result):
+        return stat_result.st_uid == os.getuid() and not stat_result.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+    @staticmethod
+    def _is_roles_response(response):
+        try:
+            results = response["json"]["results"]
+        except (KeyError, TypeError):
+            return False
+        return isinstance(results, list) and all(isinstance(role, dict) and "name" in role and "id" in role for role in results)
 
     def objects_could_be_different(self, old, new, field_set=None, warning=False):
         if field_set is None:
@@ -81,21 +81,21 @@ EXAMPLES = """
 
 from ..module_utils.eda_module import EDAModule
 
+# Any additional arguments that are not fields of the item can be added here
+_ARGUMENT_SPEC = dict(
+    name=dict(required=True),
+    new_name=dict(),
+    description=dict(),
+    url=dict(required=True, aliases=["scm_url"]),
+    tls_validation=dict(type="bool", default=True),
+    credential=dict(),
+    state=dict(choices=["present", "absent"], default="present"),
+)
 
-def main():
-    # Any additional arguments that are not fields of the item can be added here
-    argument_spec = dict(
-        name=dict(required=True),
-        new_name=dict(),
-        description=dict(),
-        url=dict(required=True, aliases=["scm_url"]),
-        tls_validation=dict(type="bool", default=True),
-        credential=dict(),
-        state=dict(choices=["present", "absent"], default="present"),
-    )
 
+def main():
     # Create a module for ourselves
-    module = EDAModule(argument_spec=argument_spec)
+    module = EDAModule(argument_spec=_ARGUMENT_SPEC)
 
     # Extract our parameters
     name = module.params.get("name")
@@ -66,18 +66,18 @@ EXAMPLES = """
 
 from ..module_utils.eda_module import EDAModule
 
+# Any additional arguments that are not fields of the item can be added here
+_ARGUMENT_SPEC = dict(
+    name=dict(required=True),
+    wait=dict(default=True, type="bool"),
+    interval=dict(default=1.0, type="float"),
+    timeout=dict(default=None, type="int"),
+)
 
-def main():
-    # Any additional arguments that are not fields of the item can be added here
-    argument_spec = dict(
-        name=dict(required=True),
-        wait=dict(default=True, type="bool"),
-        interval=dict(default=1.0, type="float"),
-        timeout=dict(default=None, type="int"),
-    )
 
+def main():
     # Create a module for ourselves
-    module = EDAModule(argument_spec=argument_spec)
+    module = EDAModule(argument_spec=_ARGUMENT_SPEC)
 
     # Extract our parameters
     name = module.params.get("name")
@@ -111,24 +111,42 @@ EXAMPLES = """
 from ..module_utils.eda_module import EDAModule
 import json
 
+# Any additional arguments that are not fields of the item can be added here
+_ARGUMENT_SPEC = dict(
+    name=dict(required=True),
+    description=dict(),
+    project=dict(),
+    rulebook=dict(required=True),
+    decision_environment=dict(required=True),
+    restart_policy=dict(choices=["always", "never", "on_failure"], default="always"),
+    extra_vars=dict(type="dict"),
+    enabled=dict(type="bool", default=True),
+    state=dict(choices=["present", "absent", "restarted"], default="present"),
+    awx_token=dict(no_log=False),
+)
+
+
+def dependency_lookups(module):
+    # The lookups for the ids of the objects an activation refers to, keyed by the field they fill in
+    lookups = {}
+    for field_name, endpoint, param_name in (
+        ("project_id", "projects", "project"),
+        ("decision_environment_id", "decision-environments", "decision_environment"),
+        ("awx_token_id", "users/me/awx-tokens", "awx_token"),
+    ):
+        if module.params.get(param_name) is not None:
+            lookups[field_name] = (module.resolve_name_to_id, (endpoint, module.params.get(param_name)), {})
+    return lookups
 
-def main():
-    # Any additional arguments that are not fields of the item can be added here
-    argument_spec = dict(
-        name=dict(required=True),
-        description=dict(),
-        project=dict(),
-        rulebook=dict(required=True),
-        decision_environment=dict(required=True),
-        restart_policy=dict(choices=["always", "never", "on_failure"], default="always"),
-        extra_vars=dict(type="dict"),
-        enabled=dict(type="bool", default="true"),
-        state=dict(choices=["present", "absent", "restarted"], default="present"),
-        awx_token=dict(no_log=False),
-    )
 
+def run_lookups(module, lookups):
+    lookup_names = list(lookups.keys())
+    return dict(zip(lookup_names, module.run_concurrently(*[lookups[lookup_name] for lookup_name in lookup_names])))
+
+
+def main():
     # Create a module for ourselves
-    module = EDAModule(argument_spec=argument_spec, required_if=[("state", "present", ("rulebook", "decision_environment"))])
+    module = EDAModule(argument_spec=_ARGUMENT_SPEC, required_if=[("state", "present", ("rulebook", "decision_environment"))])
 
     # Extract our parameters
     name = module.params.get("name")
@@ -137,7 +155,12 @@ def main():
     new_fields = {}
 
     # Attempt to look up an existing item based on the provided data
-    existing_item = module.get_one("activations", name_or_id=name, key="req_url")
+    # The objects it refers to don't depend on each other, so when creating or updating they are looked up at the same time
+    lookups = {"existing_item": (module.get_one, ("activations",), {"name_or_id": name, "key": "req_url"})}
+    if state == "present":
+        lookups.update(dependency_lookups(module))
+    resolved_ids = run_lookups(module, lookups)
+    existing_item = resolved_ids.pop("existing_item")
 
     if state == "absent":
         # If the state was absent we can let the module delete it if needed, the module will handle exiting from this
@@ -151,48 +174,50 @@ def main():
             # If the state was restarted we will hit the restart endpoint, the module will handle exiting from this
             # If the item doesn't exist we will just create it anyway
             module.trigger_post_action("activations/{id}/restart".format(id=existing_item["id"]), auto_exit=True)
+        # Otherwise we fall through to enabling or creating the activation, which does need the objects it refers to
+        resolved_ids = run_lookups(module, dependency_lookups(module))
 
     # Create the data that gets sent for create and update
     # Remove these two comments for final
     # Check that Links and groups works with this.
-    for field_name in (
-        "name",
-        "description",
-        "restart_policy",
-    ):
-        field_val = module.params.get(field_name)
-        if field_val is not None:
-            new_fields[field_name] = field_val
+    new_fields.update(
+        (field_name, module.params[field_name])
+        for field_name in (
+            "name",
+            "description",
+            "restart_policy",
+        )
+        if module.params.get(field_name) is not None
+    )
 
     if module.params.get("enabled") is not None:
         new_fields["is_enabled"] = module.params.get("enabled")
 
-    if (module.params.get("project") is not None) and (module.params.get("rulebook") is not None):
-        new_fields["project_id"] = module.resolve_name_to_id("projects", module.params.get("project"))
-        new_fields["rulebook_id"] = module.resolve_name_to_id("rulebooks",
-                                                              module.params.get("rulebook"),
-                                                              data={"project_id": int(new_fields["project_id"])},
-                                                              )
-    else:
-        new_fields["rulebook_id"] = module.resolve_name_to_id("rulebooks", module.params.get("rulebook"))
-
-    if module.params.get("decision_environment") is not None:
-        new_fields["decision_environment_id"] = module.resolve_name_to_id("decision-environments", module.params.get("decision_environment"))
-
-    if module.params.get("awx_token") is not None:
-        new_fields["awx_token_id"] = module.resolve_name_to_id("users/me/awx-tokens", module.params.get("awx_token"))
+    # The rulebook is scoped to the project so has to wait for it, but it can be looked up alongside any existing extra_vars
+    project_id = resolved_ids.pop("project_id", None)
+    rulebook_data = {}
+    if project_id is not None:
+        new_fields["project_id"] = project_id
+        rulebook_data["project_id"] = int(project_id)
+    lookups = [(module.resolve_name_to_id, ("rulebooks", module.params.get("rulebook")), {"data": rulebook_data})]
+    check_existing_vars = module.params.get("extra_vars") is not None and existing_item is not None and existing_item["extra_var_id"]
+    if check_existing_vars:
+        lookups.append((module.get_by_id, ("extra-vars",), {"id": existing_item["extra_var_id"]}))
+    results = module.run_concurrently(*lookups)
+    new_fields["rulebook_id"] = results[0]
+
+    # The decision environment and awx token ids
+    new_fields.update(resolved_ids)
 
     # Create the extra_vars
     if module.params.get("extra_vars") is not None:
         if existing_item is not None:
             new_fields["extra_var_id"] = -1  # Default it as something that isn't acceptable. Prove otherwise
-            if existing_item["extra_var_id"]:
-                # Check if matching existing extra_vars
-                existing_vars = module.get_by_id("extra-vars", id=existing_item["extra_var_id"])
-                # Test if the same
-                if json.dumps(module.params.get("extra_vars")) == existing_vars["extra_var"]:
-                    new_fields["extra_var_id"] = existing_item["extra_var_id"]
+            # Test if the same as the existing extra_vars
+            if check_existing_vars and json.dumps(module.params.get("extra_vars")) == results[1]["extra_var"]:
+                new_fields["extra_var_id"] = existing_item["extra_var_id"]
         else:
+            # Only created once every lookup has succeeded, so a failed lookup can't leave an unused extra_vars behind
             new_fields["extra_var_id"] = module.create_no_name(
                 {"extra_var": json.dumps(module.params.get("extra_vars"))},
                 endpoint="extra-vars",
@@ -221,11 +246,16 @@ def main():
         module.exit_json(**module.json_output)
 
     # If the state was present and we can let the module build or update the existing item, this will return on its own
+    # If the activation can't be created, remove the extra_vars made for it so they aren't left orphaned
+    def remove_extra_vars(module, response):
+        module.delete_endpoint_or_warn("extra-vars/{id}".format(id=new_fields["extra_var_id"]))
+
     module.create_if_needed(
         existing_item,
         new_fields,
         endpoint="activations",
         item_type="rulebook_activations",
+        on_failure=remove_extra_vars if "extra_var_id" in new_fields else None,
     )
 
 
@@ -93,23 +93,23 @@ EXAMPLES = """
 
 from ..module_utils.eda_module import EDAModule
 
+# Any additional arguments that are not fields of the item can be added here
+_ARGUMENT_SPEC = dict(
+    username=dict(required=True),
+    new_username=dict(),
+    first_name=dict(),
+    last_name=dict(),
+    email=dict(),
+    password=dict(no_log=True),
+    update_secrets=dict(type='bool', default=True, no_log=False),
+    roles=dict(type="list", elements="str"),
+    state=dict(choices=["present", "absent"], default="present"),
+)
 
-def main():
-    # Any additional arguments that are not fields of the item can be added here
-    argument_spec = dict(
-        username=dict(required=True),
-        new_username=dict(),
-        first_name=dict(),
-        last_name=dict(),
-        email=dict(),
-        password=dict(no_log=True),
-        update_secrets=dict(type='bool', default=True, no_log=False),
-        roles=dict(type="list", elements="str"),
-        state=dict(choices=["present", "absent"], default="present"),
-    )
 
+def main():
     # Create a module for ourselves
-    module = EDAModule(argument_spec=argument_spec)
+    module = EDAModule(argument_spec=_ARGUMENT_SPEC)
 
     # Extract our parameters
     username = module.params.get("username")
@@ -119,7 +119,12 @@ def main():
     new_fields = {}
 
     # Attempt to look up an existing item based on the provided data
-    existing_item = module.get_one("users", name_or_id=username, key="req_url")
+    # If roles are needed too they are fetched at the same time, as neither lookup depends on the other
+    lookups = [(module.get_one, ("users",), {"name_or_id": username, "key": "req_url"})]
+    if state != "absent" and module.params.get("roles") is not None:
+        lookups.append((module.get_role_ids_by_name, (), {}))
+    results = module.run_concurrently(*lookups)
+    existing_item = results[0]
 
     if state == "absent":
         # If the state was absent we can let the module delete it if needed, the module will handle exiting from this
@@ -129,19 +134,31 @@ def main():
     # Remove these two comments for final
     # Check that Links and groups works with this.
     new_fields["username"] = new_username if new_username else (existing_item["username"] if existing_item else username)
-    for field_name in (
-        "first_name",
-        "last_name",
-        "email",
-        "password",
-    ):
-        field_val = module.params.get(field_name)
-        if field_val is not None:
-            new_fields[field_name] = field_val
+    new_fields.update(
+        (field_name, module.params[field_name])
+        for field_name in (
+            "first_name",
+            "last_name",
+            "email",
+            "password",
+        )
+        if module.params.get(field_name) is not None
+    )
 
     if module.params.get("roles") is not None:
-        roles = module.params.get("roles")
-        new_fields["roles"] = list(map(lambda role: module.resolve_name_to_id("roles", role), roles))
+        role_ids_by_name = results[1]
+        try:
+            new_roles = frozenset(role_ids_by_name[role] for role in module.params.get("roles"))
+        except KeyError as ke:
+            module.fail_json(msg="The role {0} does not exist".format(ke))
+
+        # Role order has no meaning to the API, so only send roles when the set differs from what the user already has
+        if existing_item is not None and "roles" in existing_item:
+            existing_roles = frozenset(role["id"] if isinstance(role, dict) else role for role in existing_item["roles"])
+            if existing_roles != new_roles:
+                new_fields["roles"] = list(new_roles)
+        else:
+            new_fields["roles"] = list(new_roles)
 
     # If the state was present and we can let the module build or update the existing item, this will return on its own
     module.create_or_update_if_needed(